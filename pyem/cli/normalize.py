@@ -2,7 +2,8 @@ import os
 import sys
 import argparse
 from pathlib import Path
-from normalizer import Normalizer
+from pyem.normalizer import Normalizer
+from pyem.util import available_cpus
 
 
 def main(args: argparse.Namespace):
@@ -16,16 +17,17 @@ def main(args: argparse.Namespace):
     output: Path = Path(args.output or os.path.join(os.getcwd(), "picks"))
     output.mkdir(parents=True, exist_ok=True)
 
-    normalizer = Normalizer(threads=os.cpu_count() or 4)
-    normalizer.setOutput(output, True if args.override else False)
+    normalizer = Normalizer(threads=available_cpus(), native=not args.relion)
+    normalizer.setOutput(output, True if args.force else False)
 
     try:
-        normalizer.normalize(
-            input_dir=input_path,
-            bg_diameter=args.bg_diameter,
-            black_dust=args.black_dust or -1,
-            white_dust=args.white_dust or -1,
-        )
+        with normalizer:
+            normalizer.normalize(
+                input_dir=input_path,
+                bg_diameter=args.bg_diameter,
+                black_dust=args.black_dust or -1,
+                white_dust=args.white_dust or -1,
+            )
     except FileNotFoundError as e:
         print(f"[ERROR] {e}")
         return 1
@@ -36,7 +38,7 @@ def main(args: argparse.Namespace):
 def _main_():
     parser = argparse.ArgumentParser(
         description=(
-            "Normalize .mrcs particle stacks using relion_preprocess.\n"
+            "Normalize .mrcs particle stacks like relion_preprocess --norm.\n"
             "The input has to be the directory, where the stacks are stored.\n"
             "The output will be written to the specified output directory.\n"
             "If no output directory is given, it will be created in the current working directory."
@@ -47,8 +49,10 @@ def _main_():
     parser.add_argument("input", help="Directory, with the particle-stacks", nargs="*")
     parser.add_argument("output", help="Output directory")
     parser.add_argument("--bg_diameter", help="Diameter of the background circle", type=int)
-    parser.add_argument("--bg_diameter", help="Diameter of the background circle", type=int)
-    parser.add_argument("--bg_diameter", help="Diameter of the background circle", type=int)
+    parser.add_argument("--black_dust", help="Clip values below this many standard deviations", type=float)
+    parser.add_argument("--white_dust", help="Clip values above this many standard deviations", type=float)
+    parser.add_argument("--relion", help="Run relion_preprocess instead of the built-in normalization",
+                        action="store_true")
     parser.add_argument("--force", help="Force overwrite existing files", action="store_true")
     sys.exit(main(parser.parse_args()))
 
@@ -19,6 +19,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import json
+import math
 import numpy as np
 import os
 import os.path
@@ -50,8 +51,9 @@ def main(args):
         log.error("An origin must be provided via --boxsize or --origin")
         return 1
 
+    df = None
     if args.apix is None:
-        df = star.parse_star(args.input, nrows=1)
+        df = star.parse_star(args.input)
         args.apix = star.calculate_apix(df)
         if args.apix is None:
             log.warning("Could not compute pixel size, default is 1.0 Angstroms per pixel")
@@ -101,22 +103,26 @@ def main(args):
     if args.sym is not None:
         args.sym = util.relion_symmetry_group(args.sym)
 
-    df = star.parse_star(args.input)
+    if df is None:
+        df = star.parse_star(args.input)
 
-    if star.calculate_apix(df) != args.apix:
+    apix = star.calculate_apix(df)
+    if apix != args.apix:
         log.warning("Using specified pixel size of %f instead of calculated size %f" %
-                 (args.apix, star.calculate_apix(df)))
+                 (args.apix, apix))
 
     if args.cls is not None:
         df = star.select_classes(df, args.cls)
 
     if args.target is not None:
         args.target /= args.apix
-        c = args.target - args.origin
-        c = np.where(np.abs(c) < 1, 0, c)  # Ignore very small coordinates.
-        d = np.linalg.norm(c)
-        ax = c / d
-        r = geom.euler2rot(*np.array([np.arctan2(ax[1], ax[0]), np.arccos(ax[2]), np.deg2rad(args.psi)]))
+        # Scalar math on the 3-vector, ignore very small coordinates.
+        cx, cy, cz = (float(v) if abs(v) >= 1 else 0. for v in args.target - args.origin)
+        d = math.hypot(cx, cy, cz)
+        if d == 0:
+            log.error("Target must not coincide with the origin")
+            return 1
+        r = geom.euler2rot(math.atan2(cy, cx), math.acos(cz / d), math.radians(args.psi))
         d = -d
     elif args.transform is not None:
         r = args.transform[:, :3]
@@ -154,21 +160,25 @@ def main(args):
         ops = [ops[k] for k in subgroups]
         log.info("Subgroup search found %d operators" % len(subgroups))
 
-    dfs = list(subparticle_expansion(df, ops, d, rotate=args.shift_only, invert=args.invert, adjust_defocus=args.adjust_defocus))
- 
-    if args.recenter:
-        for s in dfs:
-            star.recenter(s, inplace=True)
-    
+    expansions = subparticle_expansion(df, ops, d, rotate=args.shift_only, invert=args.invert,
+                                       adjust_defocus=args.adjust_defocus)
+
     if args.suffix is None and not args.skip_join:
+        # Interleaving needs every expansion at once.
+        dfs = list(expansions)
         if len(dfs) > 1:
             df = util.interleave(dfs)
         else:
             df = dfs[0]
+        if args.recenter:  # Row-wise, so one pass over the joined table.
+            star.recenter(df, inplace=True)
         df = star.compatible(df, relion2=args.relion2, inplace=True)
         star.write_star(args.output, df, optics=(not args.relion2))
     else:
-        for i, s in enumerate(dfs):
+        # Write each expansion as soon as it is generated.
+        for i, s in enumerate(expansions):
+            if args.recenter:
+                star.recenter(s, inplace=True)
             s = star.compatible(s, relion2=args.relion2, inplace=True)
             star.write_star(os.path.join(args.output, args.suffix + "_%d" % i), s, optics=(not args.relion2))
     return 0
@@ -183,13 +193,21 @@ def subparticle_expansion(s, ops=None, dists=0, rots=None, rotate=True, invert=F
     dists = np.atleast_2d(dists)
     if len(dists) == 1:
         dists = np.repeat(dists, len(ops), axis=0)
-    for i in range(len(ops)):
-        log.debug("Yielding expansion %d" % i)
-        log.debug("Rotation: %s" % str(ops[i]).replace("\n", "\n" + " " * 10))
-        log.debug("Translation: %s (%f px)" % (str(dists[i]), np.linalg.norm(dists[i])))
-        xs = star.transform_star(s, ops[i], dists[i], rots=rots, rotate=rotate, invert=invert, adjust_defocus=adjust_defocus)
-        star.sync_origins_from_pixel(xs, inplace=True)
-        yield xs
+    ops = np.asarray(ops)
+    # Rotate all particles by a block of operators in one batched product, (K, N, 3, 3).
+    # The block size bounds the temporary to about 2**22 matrices.
+    bops = np.transpose(ops, (0, 2, 1)) if invert else ops
+    block = max(1, 2**22 // max(1, len(rots)))
+    for b in range(0, len(ops), block):
+        newrots = np.matmul(rots, bops[b:b + block, None])
+        for i in range(b, min(b + block, len(ops))):
+            log.debug("Yielding expansion %d" % i)
+            log.debug("Rotation: %s" % str(ops[i]).replace("\n", "\n" + " " * 10))
+            log.debug("Translation: %s (%f px)" % (str(dists[i]), np.linalg.norm(dists[i])))
+            xs = star.transform_star(s, ops[i], dists[i], rots=rots, rotate=rotate, invert=invert,
+                                     adjust_defocus=adjust_defocus, newrots=newrots[i - b])
+            star.sync_origins_from_pixel(xs, inplace=True)
+            yield xs
 
 
 def _main_():
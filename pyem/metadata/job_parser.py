@@ -1,38 +1,64 @@
 # copied from https://github.com/brisvag/cs2star/blob/master/src/cs2star/job_parser.py
 
-import json
+import os
 import re
 import warnings
+from collections import Counter, deque
 from pathlib import Path
-from typing import Set, Iterator
+from typing import Dict, Set, Tuple, Iterator
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
+# classifies metafiles in one scan, "bad" marks rejected or partial outputs
+_KIND = re.compile(
+    r"(?P<bad>excluded|incomplete|remainder|rejected|uncategorized|unused)"
+    r"|(?P<particles>particles)|(?P<micrographs>micrographs)"
+)
 
 class FileSet:
+    KINDS = ("particles", "micrographs")
+
     def __init__(self):
-        self.particles: Set[Path] = set()
-        self.particles_passthrough: Set[Path] = set()
-        self.micrographs: Set[Path] = set()
-        self.micrographs_passthrough: Set[Path] = set()
+        # Keyed by (kind, passthrough).
+        self.buckets: Dict[Tuple[str, bool], Set[Path]] = {
+            (kind, passthrough): set() for kind in self.KINDS for passthrough in (False, True)
+        }
 
     def __iter__(self) -> Iterator[Set[Path]]:
-        yield self.particles
-        yield self.particles_passthrough
-        yield self.micrographs
-        yield self.micrographs_passthrough
+        return iter(self.buckets.values())
+
+    def group(self, kind: str, passthrough: bool) -> Set[Path]:
+        return self.buckets[(kind, passthrough)]
+
+    @property
+    def particles(self) -> Set[Path]: return self.buckets[("particles", False)]
+
+    @property
+    def particles_passthrough(self) -> Set[Path]: return self.buckets[("particles", True)]
+
+    @property
+    def micrographs(self) -> Set[Path]: return self.buckets[("micrographs", False)]
+
+    @property
+    def micrographs_passthrough(self) -> Set[Path]: return self.buckets[("micrographs", True)]
 
     def values(self):
-        return (self.particles, self.particles_passthrough, self.micrographs, self.micrographs_passthrough)
+        return tuple(self.buckets.values())
 
     def values_cs(self):
-        return (self.particles, self.micrographs)
+        return tuple(self.buckets[(kind, False)] for kind in self.KINDS)
 
     def values_passthrough(self):
-        return (self.particles_passthrough, self.micrographs_passthrough)
+        return tuple(self.buckets[(kind, True)] for kind in self.KINDS)
 
 # copied from stemia.cryosparc.csplot
 
 class JobParser:
     SPLITJOBS = ("hetero_refine", "homo_abinit", "class_3D")
     SETJOBS   = ("particle_sets")
+    SCANDIR_MIN = 8  # stat() up to this many candidates per directory, list larger ones
 
     def __init__(self, job_dir: str | Path):
         """
@@ -42,6 +68,7 @@ class JobParser:
         """
         self.job_dir: Path = Path(job_dir).absolute()
         self.__jobs: FileSet = FileSet()
+        self._job_cache: Dict[Path, dict] = {}
 
     @property
     def jobs(self) -> FileSet: return self.__jobs
@@ -50,36 +77,42 @@ class JobParser:
         """
         Parse the job directory to find all relevant cs files.
 
-        This function will recursively explore the job directory and its parents
-        to find all the relevant files needed for the current job.
+        This function explores the job directory and its parents breadth first,
+        so closer jobs take precedence, and stops as soon as every group is filled.
         """
-        self.__jobs = self.__find_cs_files_recursive(self.job_dir)
-
-    def __find_cs_files_recursive(self, job_dir: Path, sets=None, visited=None) -> FileSet:
+        self.__jobs = FileSet()
+        queue = deque([self.job_dir])
+        visited: Set[str] = {self.job_dir.name}
+        while queue:
+            job_dir = queue.popleft()
+            try:
+                job = self.__load_job(job_dir)
+            except FileNotFoundError:
+                warnings.warn(f'parent job "{job_dir.name}" is missing or corrupted')
+                continue
+            visited.add(job["uid"])
+
+            self.__update_dict(self.__find_cs_files(job_dir, job))
+            if all(self.__jobs):
+                break
+            for parent in job["parents"]:
+                # queue every job only once, even if it is shared by several children
+                if parent in visited:
+                    continue
+                visited.add(parent)
+                queue.append(job_dir.parent / parent)
+
+    def __find_cs_files(self, job_dir: Path, job: dict, sets=None) -> FileSet:
         """
-        Recursively explore a job directory to find all the relevant cs files.
-
-        This function recurses through all the parent jobs until it finds all the files
-        required to have all the relevant info about the current job.
+        Find the relevant cs files among the outputs of a single job.
         """
-        if visited is None:
-            visited = []
-
         files: FileSet = FileSet()
 
-        job_dir = Path(job_dir).absolute()
-        try:
-            with open(job_dir / "job.json") as f:
-                job = json.load(f)
-        except FileNotFoundError:
-            warnings.warn(f'parent job "{job_dir.name}" is missing or corrupted')
-            return files
-
         j_type = job["type"]
         for output in job["output_results"]:
             metafiles = output["metafiles"]
             passthrough = output["passthrough"]
-            group = files.particles_passthrough if passthrough else files.particles
+            group = files.group("particles", passthrough)
             if j_type in self.SPLITJOBS:
                 # refine is special because the "good" output is split into multiple files
                 if (not passthrough and "particles_class_" in output["group_name"]) or (
@@ -93,62 +126,49 @@ class JobParser:
             else:
                 # every remaining job type is covered by this generic loop
                 for file in metafiles:
-                    if any(
-                        bad in file
-                        for bad in (
-                            "excluded",
-                            "incomplete",
-                            "remainder",
-                            "rejected",
-                            "uncategorized",
-                            "unused",
-                        )
-                    ):
+                    kinds = {m.lastgroup for m in _KIND.finditer(file)}
+                    if not kinds or "bad" in kinds:
                         continue
-                    if "particles" in file:
-                        group = files.particles_passthrough if passthrough else files.particles
-                    elif "micrographs" in file:
-                        group = files.micrographs_passthrough if passthrough else files.micrographs
-                    else:
-                        continue
-
-                    group.add(job_dir.parent / file)
-
-                for file_set in files:
-                    file_set = set(sorted(file_set)[-1:])
+                    kind = "particles" if "particles" in kinds else "micrographs"
+                    files.group(kind, passthrough).add(job_dir.parent / file)
+
+                # keep only the latest file of each group
+                for k, file_set in files.buckets.items():
+                    files.buckets[k] = set(sorted(file_set)[-1:])
+
+        # remove non-existing files, listing a parent directory only when it holds many candidates
+        counts = Counter(f.parent for file_set in files for f in file_set)
+        listings: Dict[Path, Set[str]] = {}
+        for parent, n in counts.items():
+            if n > self.SCANDIR_MIN:
+                try:
+                    with os.scandir(parent) as it:
+                        listings[parent] = {e.name for e in it}
+                except OSError:
+                    listings[parent] = set()
+
+        def exists(f: Path) -> bool:
+            return f.name in listings[f.parent] if f.parent in listings else f.exists()
 
-        # remove non-existing files
         for file_set in files:
-            for f in list(file_set):
-                if not f.exists():
-                    warnings.warn(
-                        "the following file was supposed to contain relevant information, "
-                        f"but does not exist:\n{f}"
-                    )
-                    file_set.remove(f)
-
-        for parent in job["parents"]:
-            # avoid reparsing already visited jobs
-            if job["uid"] in visited:
-                continue
-            else:
-                visited.append(job["uid"])
+            for f in [f for f in file_set if not exists(f)]:
+                warnings.warn(
+                    "the following file was supposed to contain relevant information, "
+                    f"but does not exist:\n{f}"
+                )
+                file_set.remove(f)
 
-            self.__update_dict(self.__find_cs_files_recursive(job_dir.parent / parent, visited=visited))
-            if all(files): break
-            
         return files
-    
+
+    def __load_job(self, job_dir: Path) -> dict:
+        """Parse the job.json of a job directory, once per directory."""
+        if job_dir not in self._job_cache:
+            self._job_cache[job_dir] = _loads((job_dir / "job.json").read_bytes())
+        return self._job_cache[job_dir]
+
     def __update_dict(self, d2: FileSet):
-        """Recursively update nested dict."""
-        # Particles
-        if not self.__jobs.particles:
-            self.__jobs.particles.update(d2.particles)
-        if not self.__jobs.particles_passthrough:
-            self.__jobs.particles_passthrough.update(d2.particles_passthrough)
-
-        # Micrographs
-        if not self.__jobs.micrographs:
-            self.__jobs.micrographs.update(d2.micrographs)
-        if not self.__jobs.micrographs_passthrough:
-            self.__jobs.micrographs_passthrough.update(d2.micrographs_passthrough)
+        """Fill every still empty bucket from d2."""
+        for k, s in d2.buckets.items():
+            if not self.__jobs.buckets[k]:
+                self.__jobs.buckets[k] |= s
+
@@ -85,6 +85,47 @@ def read_header(fname):
     return hdr
 
 
+def clear_stats(fname):
+    """
+    Mark the density statistics in a MRC header as unreliable, e.g. after
+    the data was modified in place.
+    :param fname: Path of the MRC file.
+    """
+    with open(fname, 'r+b') as f:
+        f.seek(19 * 4)
+        np.array([1, 0, -1], dtype=np.float32).tofile(f)  # amin, amax, amean.
+        f.seek(54 * 4)
+        np.array([-1], dtype=np.float32).tofile(f)  # RMS.
+
+
+def memmap_imgs(fname, mode="r"):
+    """
+    Memory-map the data of an MRC stack as a (nz, ny, nx) array.
+    :param fname: Source path.
+    :param mode: Mode passed to np.memmap, "r+" allows writing in place.
+    """
+    hdr = read_header(fname)
+    if hdr['datatype'] not in MODE:
+        raise IOError("Unknown MRC data type %d" % hdr['datatype'])
+    return np.memmap(fname, dtype=MODE[hdr['datatype']], mode=mode, offset=HEADER_LEN,
+                     shape=(hdr['nz'], hdr['ny'], hdr['nx']))
+
+
+def memmap_new(fname, shape, dtype=np.float32, psz: float=1.0):
+    """
+    Create a MRC file and memory-map its data as a writable (nz, ny, nx) array.
+    :param fname: Destination path.
+    :param shape: Size of the data as (nx, ny, nz).
+    :param dtype: Data type of the new file.
+    :param psz: Pixel size in Å for MRC header.
+    """
+    header = mrc_header(shape, dtype=dtype, psz=psz)
+    with open(fname, 'wb') as f:
+        f.write(header.tobytes())
+        f.truncate(HEADER_LEN + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return np.memmap(fname, dtype=dtype, mode="r+", offset=HEADER_LEN, shape=tuple(shape[::-1]))
+
+
 def read(fname, inc_header=False, compat="mrc2014"):
     if "relion" in compat.lower() or "xmipp" in compat.lower():
         order = "C"
@@ -1 +1,2 @@
-from .normalizer import Normalizer
\ No newline at end of file
+from .normalizer import Normalizer
+from .normalizer_numba import *
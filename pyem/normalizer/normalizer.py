@@ -1,18 +1,82 @@
+import os
+import platform
 import subprocess
-from os import devnull
+import tempfile
+import numba
+import numpy as np
 from pathlib import Path
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rich.progress import Progress
 
-from util import get_relion_command
-from normalizer import Normalizer
+from pyem import mrc
+from pyem.util import available_cpus, get_relion_command
+from .normalizer_numba import normalize_stack_nb
+
+
+def background_mask(ny: int, nx: int, bg_radius: float) -> np.ndarray:
+    """Boolean (ny, nx) mask of the pixels outside the background circle."""
+    y, x = np.ogrid[-(ny // 2):ny - ny // 2, -(nx // 2):nx - nx // 2]
+    return x ** 2 + y ** 2 > bg_radius ** 2
+
+
+def normalize_stack(data: np.ndarray, mask: np.ndarray, black_dust: float = -1, white_dust: float = -1) -> np.ndarray:
+    """
+    Normalize a (N, ny, nx) particle stack in place, as relion_preprocess --norm.
+
+    Each image is shifted and scaled to zero mean and unit standard deviation
+    of its background pixels. Positive dust thresholds clip the normalized
+    values at -black_dust and white_dust standard deviations. Images are
+    left unscaled if the mask has no background pixels.
+    """
+    if mask.any():
+        # Shifted by the first background pixel, so constant backgrounds have exactly zero deviation.
+        bg = data[:, mask]
+        shift = bg[:, 0].copy()
+        bg -= shift[:, None]
+        mu = bg.mean(axis=1) + shift
+        sig = bg.std(axis=1)
+        sig[sig == 0] = 1
+    else:
+        mu = np.zeros(len(data))
+        sig = np.ones(len(data))
+    data -= mu[:, None, None]
+    data /= sig[:, None, None]
+    if black_dust > 0 or white_dust > 0:
+        np.clip(data, -black_dust if black_dust > 0 else None, white_dust if white_dust > 0 else None, out=data)
+    return data
+
 
 class Normalizer:
-    def __init__(self, threads: int = 4) -> None:
-        self.threads: int = threads
+    def __init__(self, threads: int | None = None, native: bool = True) -> None:
+        self.threads: int = threads or available_cpus()
+        self.native: bool = native
         self.override: bool = False
         self.output_dir: Path | None = None
-        self.relion_path: str = get_relion_command("relion_preprocess")
+        self.relion_path: str | None = None if native else get_relion_command("relion_preprocess")
+        # Shared by all relion_preprocess calls instead of opening /dev/null per call.
+        self._devnull_fd: int | None = None if native else os.open(os.devnull, os.O_WRONLY)
+        self._executor: ThreadPoolExecutor | None = None
+
+    def __del__(self) -> None:
+        # Safety net for instances that are never closed.
+        if getattr(self, "_devnull_fd", None) is not None:
+            os.close(self._devnull_fd)
+            self._devnull_fd = None
+
+    def __enter__(self) -> "Normalizer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the worker pool and /dev/null descriptor kept between normalize() calls."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._devnull_fd is not None:
+            os.close(self._devnull_fd)
+            self._devnull_fd = None
 
     def setOutput(self, output_dir: str | Path, override: bool = False) -> "Normalizer":
         self.output_dir = Path(output_dir)
@@ -34,36 +98,154 @@ class Normalizer:
         if not files:
             raise FileNotFoundError(f"No .mrcs files found in {input_dir}")
 
+        # One relion_preprocess call per chunk instead of per file. Several chunks
+        # per worker keep the pool busy when stacks differ in size.
+        chunksize = max(1, len(files) // (self.threads * 4))
+        chunks = [files[i:i + chunksize] for i in range(0, len(files), chunksize)]
+
         with Progress() as progress:
             task = progress.add_task("Normalizing", total=len(files))
-            with Pool(processes=self.threads) as pool:
-                for file in files:
-                    pool.apply_async(self._normalize_file,
-                                    (file, bg_diameter // 2, black_dust, white_dust, self.override),                                    
-                                    callback=lambda _: progress.update(task, advance=1))
-                pool.close()
-                pool.join()
-
-    def _normalize_file(self, args: tuple[Path, int, int, int]) -> None:
-        input_file, bg_radius, black_dust, white_dust = args
+            if self.native:
+                # normalize_stack_nb() parallelizes over images with up to self.threads threads.
+                # Calling it from pool threads hangs the TBB threading layer at interpreter exit.
+                num_threads = numba.get_num_threads()
+                numba.set_num_threads(min(self.threads, numba.config.NUMBA_NUM_THREADS))
+                try:
+                    for chunk in chunks:
+                        progress.update(task, advance=self._normalize_native(
+                            chunk, bg_diameter // 2, black_dust, white_dust))
+                finally:
+                    numba.set_num_threads(num_threads)
+                return
+            # Workers only wait on subprocesses, threads avoid the fork and pickling overhead.
+            # The pool and /dev/null descriptor are reused by later calls until close().
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads)
+            if self._devnull_fd is None:
+                self._devnull_fd = os.open(os.devnull, os.O_WRONLY)
+            ex = self._executor
+            futs = [ex.submit(self._normalize_chunk, (chunk, bg_diameter // 2, black_dust, white_dust))
+                    for chunk in chunks]
+            for fut in as_completed(futs):
+                progress.update(task, advance=fut.result())
+
+    def _normalize_native(self, chunk: list[Path], bg_radius: int, black_dust: int, white_dust: int) -> int:
+        """
+        Normalize a chunk of stacks in process with normalize_stack_nb().
+        Returns the number of stacks in the chunk.
+        """
         assert self.output_dir is not None  # For type checker
 
-        output_file: Path = self.output_dir / input_file.name
-        if output_file.exists() and not self.override:
-            return
+        self._prefetch(chunk)
+        for file in chunk:
+            output_file: Path = self.output_dir / file.name
+            if output_file.exists() and not self.override:
+                continue
+            hdr = mrc.read_header(file)
+            mask = background_mask(hdr["ny"], hdr["nx"], bg_radius)
+            in_place = output_file.resolve() == file.resolve()
+            data = mrc.memmap_imgs(file, mode="r+" if in_place else "r")
+            if in_place and data.dtype == np.float32:
+                normalize_stack_nb(data, mask, data, float(black_dust), float(white_dust))
+                data.flush()
+                del data
+                mrc.clear_stats(file)
+                continue
+            if data.dtype == np.float16:
+                data = np.asarray(data, dtype=np.float32)  # Numba can't type float16.
+            # Reads from the page cache and writes the output pages directly, no stack sized buffers.
+            # The output is only renamed into place once complete, so failures leave no stack behind.
+            tmp_file = output_file.with_name(f".{output_file.name}.tmp")
+            try:
+                out = mrc.memmap_new(tmp_file, (hdr["nx"], hdr["ny"], hdr["nz"]), psz=hdr["xlen"] / hdr["nx"])
+                normalize_stack_nb(data, mask, out, float(black_dust), float(white_dust))
+                out.flush()
+                del data, out
+                os.replace(tmp_file, output_file)
+            except BaseException:
+                tmp_file.unlink(missing_ok=True)
+                raise
+        return len(chunk)
+
+    def _normalize_chunk(self, args: tuple[list[Path], int, int, int]) -> int:
+        """
+        Normalize a chunk of stacks with a single relion_preprocess call.
+
+        The stacks are listed in a temporary STAR file, normalized into one
+        combined stack and split back into one output stack per input file.
+        Returns the number of stacks in the chunk.
+        """
+        chunk, bg_radius, black_dust, white_dust = args
+        assert self.output_dir is not None  # For type checker
+
+        files: list[Path] = [f for f in chunk if self.override or not (self.output_dir / f.name).exists()]
+        # STAR values are whitespace separated, such paths can't be listed for RELION.
+        for f in [f for f in files if any(c.isspace() for c in str(f.absolute()))]:
+            print(f"[ERROR] Skipped: {f}: relion_preprocess does not accept paths with whitespace")
+            files.remove(f)
+        if not files:
+            return len(chunk)
+        self._prefetch(files)
+        hdrs = [mrc.read_header(f) for f in files]
+        sizes: list[int] = [int(hdr["nz"]) for hdr in hdrs]
+
+        with tempfile.TemporaryDirectory(dir=self.output_dir) as tmp:
+            star_file = Path(tmp) / "chunk.star"
+            stack_file = Path(tmp) / "chunk.mrcs"
+            # RELION 3.1 style tables, one optics group per stack. relion_preprocess writes
+            # the images to the output stack in the order of the particle table.
+            with open(star_file, "w") as f:
+                f.write("\ndata_optics\n\nloop_\n_rlnOpticsGroupName #1\n_rlnOpticsGroup #2\n"
+                        "_rlnImagePixelSize #3\n_rlnImageSize #4\n_rlnImageDimensionality #5\n")
+                for g, hdr in enumerate(hdrs, start=1):
+                    f.write(f"opticsGroup{g} {g} {hdr['xlen'] / hdr['nx']:.6f} {hdr['nx']} 2\n")
+                f.write("\n\ndata_particles\n\nloop_\n_rlnImageName #1\n_rlnOpticsGroup #2\n")
+                for g, (file, n) in enumerate(zip(files, sizes), start=1):
+                    for i in range(1, n + 1):
+                        f.write(f"{i:06d}@{file.absolute()} {g}\n")
+
+            cmd: list[str] = [
+                self.relion_path,
+                "--operate_on", str(star_file),
+                "--operate_out", str(stack_file),
+                "--norm",
+                "--bg_radius", str(bg_radius),
+                "--black_dust", str(black_dust),
+                "--white_dust", str(white_dust),
+            ]
 
-        cmd: list[str] = [
-            self.relion_path,
-            "--operate_on", str(input_file),
-            "--operate_out", str(output_file),
-            "--norm",
-            "--bg_radius", str(bg_radius),
-            "--black_dust", str(black_dust),
-            "--white_dust", str(white_dust),
-        ]
-
-        with open(devnull, "w") as FNULL:
             try:
-                subprocess.run(cmd, stdout=FNULL, stderr=FNULL, check=True)
+                subprocess.run(cmd, stdout=self._devnull_fd, stderr=self._devnull_fd, check=True)
             except subprocess.CalledProcessError as e:
-                print(f"[ERROR] Failed: {input_file}: {e}")
\ No newline at end of file
+                print(f"[ERROR] Failed: {', '.join(str(f) for f in files)}: {e}")
+                return len(chunk)
+
+            start = 0
+            for file, n, hdr in zip(files, sizes, hdrs):
+                mrc.write(str(self.output_dir / file.name), mrc.read_imgs(str(stack_file), start, n),
+                          psz=hdr["xlen"] / hdr["nx"], fast=True)
+                start += n
+        return len(chunk)
+
+    @staticmethod
+    def _prefetch(files: list[Path]) -> None:
+        """
+        Ask the kernel to read the whole chunk ahead asynchronously.
+
+        The read requests for all stacks are queued at once, so the page cache
+        fills in the background instead of one image at a time as the stacks
+        are read.
+        """
+        if platform.system() != "Linux" or not hasattr(os, "posix_fadvise"):
+            return
+        for file in files:
+            try:
+                fd = os.open(file, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
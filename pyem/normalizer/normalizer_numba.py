@@ -0,0 +1,46 @@
+import numba
+import numpy as np
+
+
+@numba.jit(cache=False, nopython=True, nogil=True, parallel=True, fastmath=True)
+def normalize_stack_nb(data, mask, out, black_dust=-1., white_dust=-1.):
+    """
+    Normalize a (N, ny, nx) particle stack like normalize_stack(), into out.
+    Pass data as out to normalize in place.
+
+    The background sum and sum of squares of each image are accumulated in a
+    single branchless pass over a 0/1 weight mask, which LLVM vectorizes for
+    the host SIMD width. The pixels are shifted by the first background pixel
+    of the image and summed in float64, so the single-pass variance does not
+    cancel for large offsets or (nearly) constant backgrounds. The normalized
+    and clipped values are written in a second pass. Images are processed in
+    parallel.
+    """
+    w = mask.astype(np.float64)
+    n = w.sum()
+    j0, k0 = 0, 0
+    for j in range(mask.shape[0] * mask.shape[1]):
+        if mask[j // mask.shape[1], j % mask.shape[1]]:
+            j0, k0 = j // mask.shape[1], j % mask.shape[1]
+            break
+    for i in numba.prange(data.shape[0]):
+        shift = np.float64(data[i, j0, k0]) if n > 0 else 0.
+        s = 0.
+        ss = 0.
+        for j in range(data.shape[1]):
+            for k in range(data.shape[2]):
+                v = (np.float64(data[i, j, k]) - shift) * w[j, k]
+                s += v
+                ss += v * v
+        mu = shift + s / n if n > 0 else 0.
+        var = ss / n - (s / n) ** 2 if n > 0 else 0.
+        sig = np.sqrt(var) if var > 0 else 1.
+        for j in range(data.shape[1]):
+            for k in range(data.shape[2]):
+                v = (data[i, j, k] - mu) / sig
+                if black_dust > 0 and v < -black_dust:
+                    v = -black_dust
+                if white_dust > 0 and v > white_dust:
+                    v = white_dust
+                out[i, j, k] = v
+    return out
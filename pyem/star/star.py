@@ -440,12 +440,14 @@ def set_optics_groups(df, sep="_", idx=4, inplace=False):
 
 
 def transform_star(df, r, t=None, inplace=False, rots=None, invert=False,
-                   rotate=True, adjust_defocus=False, leftmult=False):
+                   rotate=True, adjust_defocus=False, leftmult=False, newrots=None):
     """
     Transform particle angles and origins according to a rotation
     matrix (in radians) and an optional translation vector.
     The translation may also be given as the 4th column of a 3x4 matrix,
     or as a scalar distance to be applied along the axis of rotation.
+    The transformed particle rotations may be passed precomputed as newrots,
+    e.g. from a batched product over several operators.
     """
     assert (r.shape[0] == 3)
     if r.shape[1] == 4 and t is None:
@@ -465,10 +467,11 @@ def transform_star(df, r, t=None, inplace=False, rots=None, invert=False,
     if invert:
         r = r.T
 
-    if leftmult:  # Act on the particles instead of the map (same result as r.dot(q) vs q.dot(r)).
-        newrots = np.transpose(np.dot(np.transpose(rots, (0, 2, 1)), r), (0, 2, 1)).copy()  # Must be contiguous.
-    else:
-        newrots = np.dot(rots, r)  # Works with 3D array and list of 2D arrays.
+    if newrots is None:
+        if leftmult:  # Act on the particles instead of the map (same result as r.dot(q) vs q.dot(r)).
+            newrots = np.transpose(np.dot(np.transpose(rots, (0, 2, 1)), r), (0, 2, 1)).copy()  # Must be contiguous.
+        else:
+            newrots = np.dot(rots, r)  # Works with 3D array and list of 2D arrays.
     if rotate:
         angles = np.rad2deg(rot2euler(newrots))
         newstar[Relion.ANGLES] = angles
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+from pyem.metadata.job_parser import JobParser
+
+
+def write_job(project, uid, parents, outputs, j_type="select_2D"):
+    """Write a job.json and touch its metafiles, outputs are (metafiles, passthrough) pairs."""
+    job_dir = project / uid
+    job_dir.mkdir()
+    output_results = []
+    for metafiles, passthrough in outputs:
+        output_results.append({"group_name": "particles", "metafiles": metafiles, "passthrough": passthrough})
+        for f in metafiles:
+            (project / f).touch()
+    with open(job_dir / "job.json", "w") as f:
+        json.dump({"uid": uid, "type": j_type, "parents": parents, "output_results": output_results}, f)
+
+
+class TestJobParser(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.project = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _parse(self, uid):
+        parser = JobParser(self.project / uid)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            parser.parse()
+        return parser
+
+    def test_dag(self):
+        # J4 -> (J2, J3) -> J1 -> J0, J0 is missing and must not be reached.
+        write_job(self.project, "J1", ["J0"], [(["J1/J1_micrographs.cs"], False),
+                                               (["J1/J1_passthrough_particles.cs"], True)])
+        write_job(self.project, "J2", ["J1"], [(["J2/J2_passthrough_micrographs.cs"], True)])
+        write_job(self.project, "J3", ["J1"], [(["J3/J3_particles_rejected.cs"], False)])
+        write_job(self.project, "J4", ["J2", "J3"], [(["J4/J4_particles.cs"], False)])
+        parser = self._parse("J4")
+        p = self.project
+        self.assertEqual(parser.jobs.buckets, {
+            ("particles", False): {p / "J4/J4_particles.cs"},
+            ("particles", True): {p / "J1/J1_passthrough_particles.cs"},
+            ("micrographs", False): {p / "J1/J1_micrographs.cs"},
+            ("micrographs", True): {p / "J2/J2_passthrough_micrographs.cs"},
+        })
+        self.assertEqual(sorted(d.name for d in parser._job_cache), ["J1", "J2", "J3", "J4"])
+
+    def test_early_termination(self):
+        # J2 fills every bucket, its parent J1 is never loaded.
+        write_job(self.project, "J1", [], [(["J1/J1_particles.cs"], False)])
+        write_job(self.project, "J2", ["J1"], [(["J2/J2_particles.cs", "J2/J2_micrographs.cs"], False),
+                                               (["J2/J2_passthrough_particles.cs",
+                                                 "J2/J2_passthrough_micrographs.cs"], True)])
+        parser = self._parse("J2")
+        self.assertEqual(parser.jobs.particles, {self.project / "J2/J2_particles.cs"})
+        self.assertEqual(list(parser._job_cache), [self.project / "J2"])
+
+    def test_latest_metafile(self):
+        # Only the last metafile of each group is kept, also across outputs of a job.
+        write_job(self.project, "J1", [], [(["J1/J1_002_particles.cs", "J1/J1_010_particles.cs",
+                                             "J1/J1_001_particles.cs"], False),
+                                           (["J1/J1_003_particles.cs"], False),
+                                           (["J1/J1_passthrough_particles.cs",
+                                             "J1/J1_passthrough_particles_excluded.cs"], True)])
+        parser = self._parse("J1")
+        self.assertEqual(parser.jobs.particles, {self.project / "J1/J1_010_particles.cs"})
+        self.assertEqual(parser.jobs.particles_passthrough, {self.project / "J1/J1_passthrough_particles.cs"})
+        self.assertEqual(parser.jobs.micrographs, set())
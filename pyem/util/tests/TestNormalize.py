@@ -0,0 +1,132 @@
+import numpy as np
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from pyem import mrc
+from pyem.normalizer import Normalizer, normalize_stack_nb
+from pyem.normalizer.normalizer import background_mask, normalize_stack
+
+
+def write_stack(fname, data):
+    """Write a (n, ny, nx) stack in its own dtype."""
+    with open(fname, "wb") as f:
+        f.write(mrc.mrc_header(data.shape[::-1], dtype=data.dtype).tobytes())
+        f.write(data.tobytes())
+
+
+# Stand-in for relion_preprocess, copies the listed images in particle table order.
+FAKE_RELION = """#!{python}
+import importlib.util
+import sys
+import numpy as np
+spec = importlib.util.spec_from_file_location("mrc", {mrc!r})
+mrc = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mrc)
+args = sys.argv
+star, stack = args[args.index("--operate_on") + 1], args[args.index("--operate_out") + 1]
+table, imgs = None, []
+for line in open(star):
+    line = line.strip()
+    if line.startswith("data_"):
+        table = line
+    elif table == "data_particles" and line and not line.startswith(("_", "loop_")):
+        idx, fname = line.split()[0].split("@")
+        imgs.append(mrc.read_imgs(fname, int(idx) - 1))
+mrc.write(stack, np.stack(imgs, axis=2), fast=True)
+"""
+
+
+class TestNormalizer(unittest.TestCase):
+    def _normalize(self, dtype, scale, offset, in_place=False):
+        rng = np.random.default_rng(0)
+        data = (rng.standard_normal((3, 32, 32)) * scale + offset).astype(dtype)
+        with tempfile.TemporaryDirectory() as tmp:
+            input_dir = os.path.join(tmp, "in")
+            output_dir = input_dir if in_place else os.path.join(tmp, "out")
+            os.mkdir(input_dir)
+            if not in_place:
+                os.mkdir(output_dir)
+            write_stack(os.path.join(input_dir, "stack.mrcs"), data)
+            with Normalizer(threads=2).setOutput(output_dir, in_place) as normalizer:
+                normalizer.normalize(input_dir, bg_diameter=20)
+            self.assertEqual(os.listdir(output_dir), ["stack.mrcs"])
+            out = np.array(mrc.memmap_imgs(os.path.join(output_dir, "stack.mrcs")))
+            header = np.fromfile(os.path.join(output_dir, "stack.mrcs"), dtype=np.float32, count=256)
+        self.assertEqual(out.dtype, np.float32)
+        self.assertTrue(np.array_equal(header[19:22], [1, 0, -1]))
+        self.assertEqual(header[54], -1)
+        ref = normalize_stack(data.astype(np.float64), background_mask(32, 32, 10))
+        self.assertTrue(np.allclose(out, ref, atol=1e-5))
+
+    def test_float32(self):
+        self._normalize(np.float32, 10, 1000)
+
+    def test_int16(self):
+        self._normalize(np.int16, 100, 3000)
+
+    def test_float16(self):
+        self._normalize(np.float16, 10, 100)
+
+    def test_in_place(self):
+        self._normalize(np.float32, 10, 1000, in_place=True)
+        self._normalize(np.int16, 100, 3000, in_place=True)
+
+    def test_relion_chunks(self):
+        rng = np.random.default_rng(2)
+        stacks = [rng.standard_normal((n, 16, 16)).astype(np.float32) for n in (1, 2, 3, 5, 1, 4, 2)]
+        with tempfile.TemporaryDirectory() as tmp:
+            bin_dir = os.path.join(tmp, "bin")
+            input_dir = os.path.join(tmp, "in")
+            output_dir = os.path.join(tmp, "out")
+            for d in (bin_dir, input_dir, output_dir):
+                os.mkdir(d)
+            relion = os.path.join(bin_dir, "relion_preprocess")
+            with open(relion, "w") as f:
+                f.write(FAKE_RELION.format(python=sys.executable, mrc=mrc.__file__))
+            os.chmod(relion, os.stat(relion).st_mode | stat.S_IXUSR)
+            for i, data in enumerate(stacks):
+                write_stack(os.path.join(input_dir, "stack%d.mrcs" % i), data)
+            with mock.patch.dict(os.environ, {"PATH": bin_dir + os.pathsep + os.environ["PATH"]}):
+                with Normalizer(threads=2, native=False).setOutput(output_dir) as normalizer:
+                    normalizer.normalize(input_dir, bg_diameter=10)
+            for i, data in enumerate(stacks):
+                out = np.array(mrc.memmap_imgs(os.path.join(output_dir, "stack%d.mrcs" % i)))
+                self.assertTrue(np.array_equal(out, data))
+
+
+class TestNormalizeStack(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.data = rng.standard_normal((4, 24, 24)) * 5 + 50
+        self.mask = background_mask(24, 24, 8)
+
+    def _compare(self, mask, black_dust=-1., white_dust=-1., data=None):
+        data = self.data if data is None else data
+        ref = normalize_stack(data.copy(), mask, black_dust, white_dust)
+        out = np.empty_like(data)
+        normalize_stack_nb(data, mask, out, black_dust, white_dust)
+        self.assertTrue(np.allclose(out, ref))
+        data = data.copy()
+        normalize_stack_nb(data, mask, data, black_dust, white_dust)
+        self.assertTrue(np.allclose(data, ref))
+        return ref
+
+    def test_normalize(self):
+        self._compare(self.mask)
+
+    def test_dust(self):
+        self._compare(self.mask, 0.5, 1.0)
+        self._compare(self.mask, -1., 1.0)
+
+    def test_constant_background(self):
+        for background in (1234.567, 0.1):
+            data = np.full((2, 24, 24), background)
+            data[:, 12, 12] += 5
+            ref = self._compare(self.mask, data=data)
+            self.assertAlmostEqual(np.abs(ref).max(), 5.0)
+
+    def test_empty_mask(self):
+        self._compare(np.zeros_like(self.mask))
@@ -20,6 +20,7 @@ from __future__ import absolute_import
 import bisect
 import natsort
 import numpy as np
+import os
 import pandas as pd
 import subprocess
 from shutil import which
@@ -39,6 +40,16 @@ def cent2edge(bins):
     return np.r_[-np.inf, 0.5 * (bins[:-1] + bins[1:]), np.inf]
 
 
+def available_cpus() -> int:
+    """
+    Return the number of CPUs this process may run on.
+    Respects affinity masks set by cgroups, SLURM or taskset, unlike os.cpu_count().
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 4
+
+
 def check_relion_installed() -> dict:
     """
     Check if required Relion commands are available in PATH.